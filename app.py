@@ -2,9 +2,17 @@
 # SOCIAL MEDIA REPORTING AUTOMATION – FINAL MULTI-FILE OUTPUT
 # =========================================================
 
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
 import streamlit as st
 import pandas as pd
 import numpy as np
+from openpyxl import Workbook
 
 # ---------------------------------------------------------
 # STREAMLIT SETUP
@@ -26,94 +34,168 @@ PRIORITY_BRANDS = [
     "Pedialyte", "Juven", "Glucerna"
 ]
 
+PRIORITY_RANK = {brand: rank for rank, brand in enumerate(PRIORITY_BRANDS)}
+
+PAID_TYPES = ["Branded", "Influencer", "Creator", "Shop"]
+
+CONTENT_SCOPES = {
+    "Paid": PAID_TYPES,
+    "Organic": ["Organic"],
+    "Branded": ["Branded"],
+    "Influencer": ["Influencer"],
+    "Creator": ["Creator"]
+}
+
+DIMENSIONS = [("format", "Format"), ("post_type", "Type"), ("platform", "Source")]
+
+REPORT_CACHE_DIR = "report_cache"
+
+# Most recently used uploads kept on disk; older report sets are evicted
+REPORT_CACHE_MAX_ENTRIES = 20
+
+# Cached reports are keyed on the app source too, so a deploy that changes
+# report logic never serves workbooks built by older code
+with open(__file__, "rb") as f:
+    REPORT_VERSION = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+REPORT_FILES = {scope: f"{scope}_Content_Report.xlsx" for scope in CONTENT_SCOPES}
+REPORT_FILES["Influencer_Tier"] = "Influencer_Tier_Report.xlsx"
+
 # ---------------------------------------------------------
 # LOAD + CLEAN DATA
 # ---------------------------------------------------------
 
-df = pd.read_excel(uploaded_file)
-
-df = df.rename(columns={
-    "Brand Name/Category Name": "brand",
-    "Social Channel/Platform": "platform",
-    "Type of Post (Branded, Influencer,Creators, Organic, Shop)": "post_type",
-    "Post Format (Video, Reels, Shorts, Images, Carousels)": "format",
-    "Video Plays": "views",
-    "Followers": "followers",
-    "Influencer Tier": "influencer_tier"
-})
-
-df["engagement"] = (
-    pd.to_numeric(df["Likes"], errors="coerce").fillna(0) +
-    pd.to_numeric(df["Comments"], errors="coerce").fillna(0)
-)
-
-df["views"] = pd.to_numeric(df["views"], errors="coerce").fillna(0)
-df["followers"] = pd.to_numeric(df["followers"], errors="coerce").fillna(0)
-
-df["brand"] = df["brand"].astype(str).str.strip().str.title()
-
-df["post_type"] = (
-    df["post_type"]
-    .astype(str)
-    .str.title()
-    .replace({"Tagged": "Influencer", "Creators": "Creator"})
-)
-
-df["format"] = (
-    df["format"]
-    .astype(str)
-    .str.title()
-    .replace({
-        "Images": "Image",
-        "Reels": "Shorts",
-        "Sidecar": "Carousel",
-        "Image+Video": "Carousel"
+def clean_labels(values, clean, replacements=None):
+    # Labels repeat heavily, so clean each distinct value once and map back
+    replacements = replacements or {}
+    raw = values.astype("string[pyarrow]")
+    mapping = {}
+    for value in raw.dropna().unique():
+        cleaned = clean(value)
+        mapping[value] = replacements.get(cleaned, cleaned)
+    return raw.map(mapping)
+
+# Cached on the upload bytes, so widget reruns skip parsing and cleaning;
+# bounded because the report disk cache already covers repeat uploads
+@st.cache_data(show_spinner=False, max_entries=4, ttl="1h")
+def load_data(file_bytes):
+    df = pd.read_excel(BytesIO(file_bytes), engine="calamine")
+
+    df = df.rename(columns={
+        "Brand Name/Category Name": "brand",
+        "Social Channel/Platform": "platform",
+        "Type of Post (Branded, Influencer,Creators, Organic, Shop)": "post_type",
+        "Post Format (Video, Reels, Shorts, Images, Carousels)": "format",
+        "Video Plays": "views",
+        "Followers": "followers",
+        "Influencer Tier": "influencer_tier"
     })
-)
 
-df["is_dynamic"] = df["format"].isin(["Video", "Shorts"])
-df["is_paid"] = df["post_type"].isin(["Branded", "Influencer", "Creator", "Shop"])
+    # One float64 buffer per column, blanks zeroed in place
+    numeric = {}
+    for col in ["Likes", "Comments", "views", "followers"]:
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64, copy=True)
+        values[np.isnan(values)] = 0
+        numeric[col] = values
+
+    df["engagement"] = numeric["Likes"] + numeric["Comments"]
+    df["views"] = numeric["views"]
+    df["followers"] = numeric["followers"]
+
+    df["brand"] = clean_labels(df["brand"], lambda x: x.strip().title())
+
+    df["post_type"] = clean_labels(
+        df["post_type"],
+        str.title,
+        {"Tagged": "Influencer", "Creators": "Creator"}
+    )
+
+    df["format"] = clean_labels(
+        df["format"],
+        str.title,
+        {
+            "Images": "Image",
+            "Reels": "Shorts",
+            "Sidecar": "Carousel",
+            "Image+Video": "Carousel"
+        }
+    )
+
+    # Low-cardinality labels: group on integer codes instead of strings
+    for col in ["brand", "post_type", "format", "platform", "influencer_tier"]:
+        df[col] = df[col].astype("category")
+
+    # Rows in grouping-key order, so each group's values sit contiguously
+    df = df.sort_values(
+        ["post_type", "brand", "format", "platform"], kind="mergesort"
+    ).reset_index(drop=True)
+
+    df["is_dynamic"] = df["format"].isin(["Video", "Shorts"])
+
+    # Dynamic-only engagement/views, so ER can be computed from plain sums
+    df["video_engagement"] = np.where(df["is_dynamic"], df["engagement"], 0)
+    df["video_views"] = np.where(df["is_dynamic"], df["views"], 0)
+
+    return df
 
 # ---------------------------------------------------------
 # HELPERS
 # ---------------------------------------------------------
 
+def brand_priority(brands):
+    # Rank each brand category once, then gather ranks by code; the trailing
+    # entry is the rank for code -1 (missing brand)
+    ranks = [PRIORITY_RANK.get(b, len(PRIORITY_BRANDS)) for b in brands.cat.categories]
+    ranks = np.array(ranks + [len(PRIORITY_BRANDS)], dtype=np.int8)
+    return ranks[brands.cat.codes.to_numpy()]
+
 def brand_sort(df, volume_col):
-    df = df.copy()
-    df["_priority"] = df["brand"].apply(
-        lambda x: PRIORITY_BRANDS.index(x)
-        if x in PRIORITY_BRANDS else len(PRIORITY_BRANDS)
+    # Sort on standalone key arrays and gather rows once, without copying df;
+    # "-" placeholders rank above any value, as they did with sort_values
+    priority = brand_priority(df["brand"])
+    volume = pd.to_numeric(df[volume_col], errors="coerce").fillna(np.inf).to_numpy()
+    return df.iloc[np.lexsort((-volume, priority))]
+
+def aggregate_metrics(data, keys):
+    return data.groupby(keys, observed=True).agg(
+        post_count=("engagement", "size"),
+        engagement=("engagement", "sum"),
+        followers=("followers", "sum"),
+        dynamic_posts=("is_dynamic", "sum"),
+        video_engagement=("video_engagement", "sum"),
+        video_views=("video_views", "sum"),
     )
-    df = df.sort_values(by=["_priority", volume_col], ascending=[True, False])
-    return df.drop(columns="_priority")
-
-def calculate_er(x):
-    if x["is_dynamic"].any():
-        v = x.loc[x["is_dynamic"], "views"].sum()
-        e = x.loc[x["is_dynamic"], "engagement"].sum()
-        return e / v if v > 0 else None
-    else:
-        f = x["followers"].sum()
-        e = x["engagement"].sum()
-        return e / f if f > 0 else None
-
-def generate_tables(data, dimension):
+
+def safe_divide(numerator, denominator):
+    out = np.full(len(numerator), np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+def calculate_er(metrics):
+    # Groups with any Video/Shorts use dynamic views, others use followers
+    cols = {c: metrics[c].to_numpy(dtype=np.float64) for c in metrics.columns}
+    video_er = safe_divide(cols["video_engagement"], cols["video_views"])
+    static_er = safe_divide(cols["engagement"], cols["followers"])
+    return np.where(cols["dynamic_posts"] > 0, video_er, static_er)
+
+def scope_metrics(metrics, codes, dimension):
+    # Metrics are plain sums, so a scope is the sum of its post types' rows
+    in_scope = np.isin(metrics.index.get_level_values("post_type").codes, codes)
+    return metrics[in_scope].groupby(level=["brand", dimension], observed=True).sum()
+
+def generate_tables(metrics, dimension):
+    er = pd.Series(calculate_er(metrics), index=metrics.index)
+
     # Post Count
     post_count = (
-        data.groupby(["brand", dimension])
-        .size()
-        .reset_index(name="Post Count")
-        .pivot(index="brand", columns=dimension, values="Post Count")
-        .fillna(0)
+        metrics["post_count"]
+        .unstack(dimension, fill_value=0)
         .reset_index()
     )
 
     # Avg ER
     avg_er = (
-        data.groupby(["brand", dimension])
-        .apply(calculate_er)
-        .reset_index(name="Avg ER%")
-        .pivot(index="brand", columns=dimension, values="Avg ER%")
+        er.unstack(dimension)
         .reset_index()
         .fillna("-")
     )
@@ -123,68 +205,152 @@ def generate_tables(data, dimension):
 
     return post_count, avg_er
 
-# ---------------------------------------------------------
-# CONTENT SCOPES
-# ---------------------------------------------------------
-
-content_scopes = {
-    "Paid": df[df["is_paid"]],
-    "Organic": df[df["post_type"] == "Organic"],
-    "Branded": df[df["post_type"] == "Branded"],
-    "Influencer": df[df["post_type"] == "Influencer"],
-    "Creator": df[df["post_type"] == "Creator"]
-}
-
-# ---------------------------------------------------------
-# EXPORT EACH SCOPE AS SEPARATE FILE
-# ---------------------------------------------------------
-
-download_files = {}
-
-for scope, sdf in content_scopes.items():
-    file_name = f"{scope}_Content_Report.xlsx"
+def write_report(file_name, sheets):
+    # Write-only workbook streams rows instead of building a Cell per value
+    wb = Workbook(write_only=True)
+    for sheet_name, table in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        ws.append(list(table.columns))
+        for row in table.itertuples(index=False):
+            ws.append(row)
+    # Save to a per-writer temp file so an interrupted or concurrent run never
+    # leaves a half-written file in the cache
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or ".", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(tmp_name)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+def scope_tables(dimension_metrics, codes, dimension):
+    metrics = scope_metrics(dimension_metrics[dimension], codes, dimension)
+    # Scopes with no posts get header-only sheets instead of empty pivots
+    if metrics.empty:
+        empty = pd.DataFrame(columns=["brand"])
+        return empty, empty
+    return generate_tables(metrics, dimension)
+
+def export_scopes(dimension_metrics, scopes, codes, report_dir):
+    # Scopes covering the same present post types share identical tables,
+    # so compute them once and only vary the sheet names per scope
+    tables = {dim: scope_tables(dimension_metrics, codes, dim) for dim, _ in DIMENSIONS}
+
+    for scope in scopes:
+        sheets = {}
+        for dim, label in DIMENSIONS:
+            pc, er = tables[dim]
+            sheets[f"{scope}_Brand_{label}_PostCount"] = pc
+            sheets[f"{scope}_Brand_{label}_AvgER"] = er
+
+        write_report(os.path.join(report_dir, REPORT_FILES[scope]), sheets)
+
+def build_reports(file_bytes, report_dir):
+    df = load_data(file_bytes)
+    os.makedirs(report_dir, exist_ok=True)
+
+    # post_type is always a key so scopes can be sliced out of one groupby
+    dimension_metrics = {
+        dim: aggregate_metrics(df, list(dict.fromkeys(["post_type", "brand", dim])))
+        for dim in [dim for dim, _ in DIMENSIONS] + ["influencer_tier"]
+    }
+
+    # Scopes resolved once to the post_type category codes present in the upload
+    post_type_categories = df["post_type"].cat.categories
+    present_codes = np.unique(df["post_type"].cat.codes.to_numpy())
+    scope_codes = {
+        scope: np.intersect1d(np.flatnonzero(post_type_categories.isin(post_types)), present_codes)
+        for scope, post_types in CONTENT_SCOPES.items()
+    }
+
+    scope_groups = {}
+    for scope, codes in scope_codes.items():
+        scope_groups.setdefault(codes.tobytes(), (codes, []))[1].append(scope)
+
+    # Scope groups share nothing but the read-only aggregates, so build them concurrently
+    with ThreadPoolExecutor(max_workers=len(scope_groups)) as pool:
+        futures = [
+            pool.submit(export_scopes, dimension_metrics, scopes, codes, report_dir)
+            for codes, scopes in scope_groups.values()
+        ]
+    for future in futures:
+        future.result()
+
+    # Influencer tier analysis
+    tier_post_count, tier_avg_er = scope_tables(
+        dimension_metrics, scope_codes["Influencer"], "influencer_tier"
+    )
 
-    with pd.ExcelWriter(file_name, engine="openpyxl") as writer:
-        for dim, label in [("format", "Format"), ("post_type", "Type"), ("platform", "Source")]:
-            pc, er = generate_tables(sdf, dim)
-            pc.to_excel(writer, sheet_name=f"{scope}_Brand_{label}_PostCount", index=False)
-            er.to_excel(writer, sheet_name=f"{scope}_Brand_{label}_AvgER", index=False)
+    write_report(os.path.join(report_dir, REPORT_FILES["Influencer_Tier"]), {
+        "Tier_PostCount": tier_post_count,
+        "Tier_AvgER": tier_avg_er
+    })
 
-    download_files[scope] = file_name
+# Directories can vanish at any point under a concurrent session's prune,
+# so every cache lookup below treats a missing path as "not cached"
+
+def last_used(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+def list_dir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def prune_report_cache(keep):
+    # Report sets across all versions, newest first by last use
+    entries = [
+        os.path.join(REPORT_CACHE_DIR, version, digest)
+        for version in list_dir(REPORT_CACHE_DIR)
+        for digest in list_dir(os.path.join(REPORT_CACHE_DIR, version))
+    ]
+    entries.sort(key=last_used, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+    # Drop old version directories left empty; the current one is kept so a
+    # concurrent build's makedirs never loses its parent
+    for version in list_dir(REPORT_CACHE_DIR):
+        if version == REPORT_VERSION:
+            continue
+        try:
+            os.rmdir(os.path.join(REPORT_CACHE_DIR, version))
+        except OSError:
+            pass
+
+def read_reports(report_dir):
+    # Whole report set as bytes, or None if it is incomplete or was evicted
+    try:
+        # Mark as recently used so eviction keeps it
+        os.utime(report_dir)
+        reports = {}
+        for label, file in REPORT_FILES.items():
+            with open(os.path.join(report_dir, file), "rb") as f:
+                reports[label] = f.read()
+        return reports
+    except OSError:
+        return None
 
 # ---------------------------------------------------------
-# INFLUENCER TIER ANALYSIS
+# GENERATE REPORTS (CACHED BY UPLOAD CONTENT)
 # ---------------------------------------------------------
 
-tier_df = df[df["post_type"] == "Influencer"]
-
-tier_post_count = (
-    tier_df.groupby(["brand", "influencer_tier"])
-    .size()
-    .reset_index(name="Post Count")
-    .pivot(index="brand", columns="influencer_tier", values="Post Count")
-    .fillna(0)
-    .reset_index()
-)
-
-tier_avg_er = (
-    tier_df.groupby(["brand", "influencer_tier"])
-    .apply(calculate_er)
-    .reset_index(name="Avg ER%")
-    .pivot(index="brand", columns="influencer_tier", values="Avg ER%")
-    .fillna("-")
-    .reset_index()
-)
-
-tier_post_count = brand_sort(tier_post_count, tier_post_count.columns[1])
-tier_avg_er = brand_sort(tier_avg_er, tier_avg_er.columns[1])
-
-tier_file = "Influencer_Tier_Report.xlsx"
-with pd.ExcelWriter(tier_file, engine="openpyxl") as writer:
-    tier_post_count.to_excel(writer, sheet_name="Tier_PostCount", index=False)
-    tier_avg_er.to_excel(writer, sheet_name="Tier_AvgER", index=False)
+file_bytes = uploaded_file.getvalue()
+digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+report_dir = os.path.join(REPORT_CACHE_DIR, REPORT_VERSION, digest)
 
-download_files["Influencer_Tier"] = tier_file
+reports = read_reports(report_dir)
+if reports is None:
+    # Rebuild until we hold a complete set, then prune with it safely in memory
+    while reports is None:
+        build_reports(file_bytes, report_dir)
+        reports = read_reports(report_dir)
+    prune_report_cache(REPORT_CACHE_MAX_ENTRIES)
 
 # ---------------------------------------------------------
 # DOWNLOAD SECTION
@@ -192,10 +358,9 @@ download_files["Influencer_Tier"] = tier_file
 
 st.success("All reports generated successfully 🎉")
 
-for label, file in download_files.items():
-    with open(file, "rb") as f:
-        st.download_button(
-            f"📥 Download {label} Report",
-            f,
-            file_name=file
-        )
\ No newline at end of file
+for label, file in REPORT_FILES.items():
+    st.download_button(
+        f"📥 Download {label} Report",
+        reports[label],
+        file_name=file
+    )
\ No newline at end of file